@@ -1,15 +1,67 @@
 import os
 import time
+import hmac
+import base64
+import struct
 import secrets
+import hashlib
+import asyncio
+import itertools
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
 from typing import Optional
+from urllib.parse import urlencode
 from fastapi import FastAPI, HTTPException, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
+from cachetools import TTLCache
+from fastapi_cache import FastAPICache
+from fastapi_cache.backends.inmemory import InMemoryBackend
+from fastapi_cache.backends.redis import RedisBackend
+from fastapi_cache.decorator import cache
+from redis import asyncio as aioredis
 from database import db, create_document, get_documents
-from schemas import Developer, Session, Portfolio
-import requests
+from schemas import Developer, Session
+import httpx
+import orjson
+
+GH_JSON_ACCEPT = {"Accept": "application/vnd.github+json"}
+GH_TOKEN_ACCEPT = {"Accept": "application/json"}
+
+# Shared GitHub client so logins reuse pooled TCP/TLS connections
+GH_CLIENT = httpx.AsyncClient(
+    timeout=10,
+    http2=True,
+    limits=httpx.Limits(max_connections=50, max_keepalive_connections=10),
+    headers=GH_JSON_ACCEPT,
+)
+
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if db is not None:
+        # Partial so sessions not yet backfilled by migrate_sessions.py
+        # cannot collide on a null token_hash and block startup
+        await asyncio.gather(
+            db["session"].create_index(
+                "token_hash", unique=True, partialFilterExpression={"token_hash": {"$exists": True}}
+            ),
+            db["session"].create_index("user_id", unique=True),
+            # Mongo purges sessions once expires_at has passed
+            db["session"].create_index("expires_at", expireAfterSeconds=0),
+            db["developer"].create_index("username", unique=True),
+            db["portfolio"].create_index("username", unique=True),
+        )
+    if REDIS_URL:
+        FastAPICache.init(RedisBackend(aioredis.from_url(REDIS_URL)), prefix="cache")
+    else:
+        FastAPICache.init(InMemoryBackend(), prefix="cache")
+    yield
+    await GH_CLIENT.aclose()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -19,10 +71,96 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-GITHUB_CLIENT_ID = os.getenv("GITHUB_CLIENT_ID")
-GITHUB_CLIENT_SECRET = os.getenv("GITHUB_CLIENT_SECRET")
+
+def _env_list(plural: str, single: str) -> list:
+    raw = os.getenv(plural) or os.getenv(single) or ""
+    return [v.strip() for v in raw.split(",") if v.strip()]
+
+
+# OAuth apps rotated round-robin to spread GitHub rate limits;
+# GITHUB_CLIENT_IDS/GITHUB_CLIENT_SECRETS take precedence over the singular vars
+_client_ids = _env_list("GITHUB_CLIENT_IDS", "GITHUB_CLIENT_ID")
+_client_secrets = _env_list("GITHUB_CLIENT_SECRETS", "GITHUB_CLIENT_SECRET")
+if len(_client_ids) != len(_client_secrets):
+    raise RuntimeError(
+        f"GitHub OAuth misconfigured: {len(_client_ids)} client id(s) but "
+        f"{len(_client_secrets)} client secret(s); set GITHUB_CLIENT_IDS and "
+        "GITHUB_CLIENT_SECRETS (or the singular vars) with matching entries"
+    )
+if len(_client_ids) > 256:  # client index travels in the state as one byte
+    raise RuntimeError("GitHub OAuth misconfigured: at most 256 client apps are supported")
+GITHUB_CLIENTS = list(zip(_client_ids, _client_secrets))
 BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8000")
 FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:3000")
+REDIS_URL = os.getenv("REDIS_URL")
+# Dedicated HMAC key for the OAuth state; OAuth endpoints refuse to run without it
+OAUTH_STATE_SECRET = os.getenv("OAUTH_STATE_SECRET")
+OAUTH_STATE_TTL = 600  # seconds
+
+# Everything but the per-request state is fixed for the process lifetime
+_AUTH_URL_PREFIXES = [
+    "https://github.com/login/oauth/authorize?" + urlencode({
+        "client_id": client_id,
+        "redirect_uri": f"{BACKEND_URL}/auth/github/callback",
+        "scope": "read:user user:email",
+        "allow_signup": "true",
+    }) + "&state="
+    for client_id, _ in GITHUB_CLIENTS
+]
+_client_rotation = itertools.cycle(range(len(GITHUB_CLIENTS)))
+
+# Resolved sessions keyed by token hash: (expires_at, user)
+SESSION_CACHE: TTLCache = TTLCache(maxsize=10_000, ttl=60)
+# username -> token hash of that user's cached session, for O(1) eviction
+SESSION_CACHE_USERS: TTLCache = TTLCache(maxsize=10_000, ttl=60)
+# username -> eviction sequence number, so a lookup that raced a login
+# does not re-cache the replaced token
+SESSION_CACHE_EVICTED: TTLCache = TTLCache(maxsize=10_000, ttl=300)
+SESSION_CACHE_LOCK = asyncio.Lock()
+_session_eviction_seq = 0
+
+
+def _hash_token(token: str) -> bytes:
+    """Session tokens are only ever stored and looked up by this digest"""
+    return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+
+async def _evict_user_sessions(username: str):
+    """Drop a user's cached session; only affects this process's cache"""
+    global _session_eviction_seq
+    async with SESSION_CACHE_LOCK:
+        _session_eviction_seq += 1
+        SESSION_CACHE_EVICTED[username] = _session_eviction_seq
+        token_hash = SESSION_CACHE_USERS.pop(username, None)
+        if token_hash is not None:
+            SESSION_CACHE.pop(token_hash, None)
+
+
+def _state_mac(payload: bytes) -> bytes:
+    return hmac.new(OAUTH_STATE_SECRET.encode(), payload, hashlib.sha256).digest()
+
+
+def _sign_state(client_idx: int) -> str:
+    """Stateless OAuth state: nonce || timestamp || client index || HMAC, so nothing is stored"""
+    payload = secrets.token_bytes(16) + struct.pack(">QB", int(time.time()), client_idx)
+    return base64.urlsafe_b64encode(payload + _state_mac(payload)).rstrip(b"=").decode()
+
+
+def _verify_state(state: Optional[str]) -> Optional[int]:
+    """Return the client index carried by a valid state, else None"""
+    try:
+        raw = base64.urlsafe_b64decode(state + "=" * (-len(state) % 4))
+    except (TypeError, ValueError):
+        return None
+    if len(raw) != 57:
+        return None
+    payload, mac = raw[:25], raw[25:]
+    if not hmac.compare_digest(mac, _state_mac(payload)):
+        return None
+    issued_at, client_idx = struct.unpack(">QB", payload[16:])
+    if abs(time.time() - issued_at) >= OAUTH_STATE_TTL or client_idx >= len(GITHUB_CLIENTS):
+        return None
+    return client_idx
 
 class AuthStartResponse(BaseModel):
     url: str
@@ -32,6 +170,13 @@ class AuthCallbackQuery(BaseModel):
     state: Optional[str] = None
 
 
+# Shared database handle dependency
+def get_db():
+    if db is None:
+        raise HTTPException(500, detail="Database not available")
+    return db
+
+
 @app.get("/")
 def read_root():
     return {"message": "Portfolio SaaS Backend Running"}
@@ -39,61 +184,57 @@ def read_root():
 
 @app.get("/auth/github/start", response_model=AuthStartResponse)
 def github_auth_start():
-    if not GITHUB_CLIENT_ID:
+    if not (GITHUB_CLIENTS and OAUTH_STATE_SECRET):
         raise HTTPException(status_code=500, detail="GitHub OAuth not configured")
-    state = secrets.token_urlsafe(16)
-    params = {
-        "client_id": GITHUB_CLIENT_ID,
-        "redirect_uri": f"{BACKEND_URL}/auth/github/callback",
-        "scope": "read:user user:email",
-        "state": state,
-        "allow_signup": "true",
-    }
-    qs = "&".join([f"{k}={v}" for k, v in params.items()])
-    return {"url": f"https://github.com/login/oauth/authorize?{qs}"}
+    client_idx = next(_client_rotation)
+    return {"url": _AUTH_URL_PREFIXES[client_idx] + _sign_state(client_idx)}
 
 
 @app.get("/auth/github/callback")
-def github_auth_callback(code: str, state: Optional[str] = None):
-    if not (GITHUB_CLIENT_ID and GITHUB_CLIENT_SECRET):
+async def github_auth_callback(code: str, state: Optional[str] = None, database = Depends(get_db)):
+    if not (GITHUB_CLIENTS and OAUTH_STATE_SECRET):
         raise HTTPException(status_code=500, detail="GitHub OAuth not configured")
+    # The state pins the OAuth app that issued the authorize URL
+    client_idx = _verify_state(state)
+    if client_idx is None:
+        raise HTTPException(400, detail="Invalid or expired OAuth state")
+    client_id, client_secret = GITHUB_CLIENTS[client_idx]
 
     # Exchange code for access token
-    token_resp = requests.post(
+    token_resp = await GH_CLIENT.post(
         "https://github.com/login/oauth/access_token",
-        headers={"Accept": "application/json"},
+        headers=GH_TOKEN_ACCEPT,
         data={
-            "client_id": GITHUB_CLIENT_ID,
-            "client_secret": GITHUB_CLIENT_SECRET,
+            "client_id": client_id,
+            "client_secret": client_secret,
             "code": code,
             "redirect_uri": f"{BACKEND_URL}/auth/github/callback",
         },
-        timeout=10,
     )
     if token_resp.status_code != 200:
         raise HTTPException(400, detail="Failed to exchange code")
-    token_json = token_resp.json()
+    token_json = orjson.loads(token_resp.content)
     access_token = token_json.get("access_token")
     if not access_token:
         raise HTTPException(400, detail="No access token from GitHub")
 
-    # Fetch user profile
-    gh_user = requests.get(
-        "https://api.github.com/user",
-        headers={"Authorization": f"Bearer {access_token}", "Accept": "application/vnd.github+json"},
-        timeout=10,
-    ).json()
-
-    emails = requests.get(
-        "https://api.github.com/user/emails",
-        headers={"Authorization": f"Bearer {access_token}", "Accept": "application/vnd.github+json"},
-        timeout=10,
-    ).json()
+    # Fetch user profile and emails concurrently
+    auth_headers = {**GH_JSON_ACCEPT, "Authorization": f"Bearer {access_token}"}
+    gh_user_r, emails_r = await asyncio.gather(
+        GH_CLIENT.get("https://api.github.com/user", headers=auth_headers),
+        GH_CLIENT.get("https://api.github.com/user/emails", headers=auth_headers),
+    )
+    gh_user = orjson.loads(gh_user_r.content)
+    emails = orjson.loads(emails_r.content)
 
     primary_email = None
     if isinstance(emails, list):
-        primary = next((e for e in emails if e.get("primary")), None)
-        primary_email = (primary or emails[0]).get("email") if emails else None
+        # Prefer the verified primary address, then any verified address
+        verified = [e for e in emails if e.get("verified") and e.get("email")]
+        primary_email = next(
+            (e["email"] for e in verified if e.get("primary")),
+            verified[0]["email"] if verified else None,
+        )
 
     dev = Developer(
         username=gh_user.get("login"),
@@ -109,19 +250,28 @@ def github_auth_callback(code: str, state: Optional[str] = None):
         public_repos=gh_user.get("public_repos"),
     )
 
-    # Upsert developer
-    if db is None:
-        raise HTTPException(500, detail="Database not available")
-    db["developer"].update_one({"username": dev.username}, {"$set": dev.model_dump()}, upsert=True)
-
     # Create session
     token = secrets.token_urlsafe(32)
-    expiry = time.time() + 60 * 60 * 24 * 7  # 7 days
-    sess = Session(token=token, user_id=dev.username, expires_at=expiry)
-    db["session"].update_one({"user_id": dev.username}, {"$set": sess.model_dump()}, upsert=True)
+    expiry = datetime.now(timezone.utc) + timedelta(days=7)
+    sess = Session(token_hash=_hash_token(token), user_id=dev.username, expires_at=expiry)
+    # Same as Portfolio(username=...).model_dump(), without building the model
+    portfolio_defaults = {
+        "username": dev.username,
+        "headline": "Building with code.",
+        "subheadline": "Developer portfolio powered by GitHub.",
+        "sections": [],
+        "theme": {"accent": "#3b82f6"},
+    }
 
-    # Ensure portfolio exists
-    db["portfolio"].update_one({"username": dev.username}, {"$setOnInsert": Portfolio(username=dev.username).model_dump()}, upsert=True)
+    # Upsert developer, session and portfolio; each targets its own
+    # collection so the three writes are issued concurrently
+    await asyncio.gather(
+        database["developer"].update_one({"username": dev.username}, {"$set": dev.model_dump()}, upsert=True),
+        database["session"].update_one({"user_id": dev.username}, {"$set": sess.model_dump(), "$unset": {"token": ""}}, upsert=True),
+        database["portfolio"].update_one({"username": dev.username}, {"$setOnInsert": portfolio_defaults}, upsert=True),
+    )
+    # The previous token and cached profile for this user are now stale
+    await _evict_user_sessions(dev.username)
 
     # Redirect to frontend with token
     redirect_url = f"{FRONTEND_URL}/auth?token={token}"
@@ -129,18 +279,42 @@ def github_auth_callback(code: str, state: Optional[str] = None):
 
 
 # Simple auth dependency using session token header
-async def get_current_user(request: Request):
+async def get_current_user(request: Request, database = Depends(get_db)):
     token = request.headers.get("x-session-token")
     if not token:
         raise HTTPException(401, detail="Missing session token")
-    if db is None:
-        raise HTTPException(500, detail="Database not available")
-    sess = db["session"].find_one({"token": token})
-    if not sess or sess.get("expires_at", 0) < time.time():
+    token_hash = _hash_token(token)
+    async with SESSION_CACHE_LOCK:
+        cached = SESSION_CACHE.get(token_hash)
+        lookup_seq = _session_eviction_seq
+    if cached:
+        expires_at, user = cached
+        if expires_at >= datetime.now(timezone.utc):
+            return user
+        async with SESSION_CACHE_LOCK:
+            SESSION_CACHE.pop(token_hash, None)
+    # Resolve session and developer in a single round-trip
+    pipeline = [
+        {"$match": {"token_hash": token_hash}},
+        {"$limit": 1},
+        {"$project": {"_id": 0, "user_id": 1, "expires_at": 1}},
+        {"$lookup": {"from": "developer", "localField": "user_id", "foreignField": "username", "as": "user"}},
+        {"$project": {"user._id": 0}},
+    ]
+    docs = await database["session"].aggregate(pipeline, hint="token_hash_1").to_list(length=1)
+    sess = docs[0] if docs else None
+    # Legacy sessions stored a float timestamp; treat them as expired
+    expires_at = sess.get("expires_at") if sess else None
+    if not isinstance(expires_at, datetime) or expires_at < datetime.now(timezone.utc):
         raise HTTPException(401, detail="Invalid or expired session token")
-    user = db["developer"].find_one({"username": sess["user_id"]}, {"_id": 0})
-    if not user:
+    if not sess["user"]:
         raise HTTPException(401, detail="User not found")
+    user = sess["user"][0]
+    async with SESSION_CACHE_LOCK:
+        # A login evicted this user mid-lookup; the session read may be stale
+        if SESSION_CACHE_EVICTED.get(user["username"], 0) <= lookup_seq:
+            SESSION_CACHE[token_hash] = (expires_at, user)
+            SESSION_CACHE_USERS[user["username"]] = token_hash
     return user
 
 
@@ -149,11 +323,21 @@ async def me(user = Depends(get_current_user)):
     return {"user": user}
 
 
+PORTFOLIO_CACHE_NAMESPACE = "portfolio"
+
+
+def _portfolio_cache_key(namespace: str, username: str) -> str:
+    return f"{FastAPICache.get_prefix()}:{namespace}:{username}"
+
+
+def portfolio_key_builder(func, namespace: str = "", *, request=None, response=None, args=(), kwargs=None):
+    return _portfolio_cache_key(namespace, kwargs["username"])
+
+
 @app.get("/portfolio/{username}")
-async def get_portfolio(username: str):
-    if db is None:
-        raise HTTPException(500, detail="Database not available")
-    p = db["portfolio"].find_one({"username": username}, {"_id": 0})
+@cache(expire=30, namespace=PORTFOLIO_CACHE_NAMESPACE, key_builder=portfolio_key_builder)
+async def get_portfolio(username: str, database = Depends(get_db)):
+    p = await database["portfolio"].find_one({"username": username}, {"_id": 0})
     if not p:
         raise HTTPException(404, detail="Portfolio not found")
     return p
@@ -167,13 +351,18 @@ class PortfolioUpdate(BaseModel):
 
 
 @app.post("/portfolio")
-async def update_portfolio(payload: PortfolioUpdate, user = Depends(get_current_user)):
-    if db is None:
-        raise HTTPException(500, detail="Database not available")
-    update = {k: v for k, v in payload.model_dump().items() if v is not None}
+async def update_portfolio(payload: PortfolioUpdate, user = Depends(get_current_user), database = Depends(get_db)):
+    update = payload.model_dump(exclude_unset=True, exclude_none=True)
     if not update:
         return {"updated": False}
-    db["portfolio"].update_one({"username": user["username"]}, {"$set": update}, upsert=True)
+    await database["portfolio"].update_one({"username": user["username"]}, {"$set": update}, upsert=True)
+    # With InMemoryBackend this only clears this worker's copy; other
+    # workers may serve the old portfolio until their 30s entry expires
+    try:
+        await FastAPICache.get_backend().clear(key=_portfolio_cache_key(PORTFOLIO_CACHE_NAMESPACE, user["username"]))
+    except KeyError:
+        # InMemoryBackend raises when the portfolio was never cached
+        pass
     return {"updated": True}
 
 
@@ -0,0 +1,49 @@
+"""
+Session Migration
+
+One-off backfill for sessions written before tokens were hashed.
+Legacy documents store the plaintext `token` and a float `expires_at`;
+this drops the old unique index on `token` and rewrites them to
+`token_hash` plus a UTC datetime so existing users stay logged in.
+
+Run once, before deploying the hashed-token release:
+    python migrate_sessions.py
+"""
+
+import asyncio
+from datetime import datetime, timezone
+from pymongo import UpdateOne
+from pymongo.errors import OperationFailure
+from database import db
+from main import _hash_token
+
+
+async def migrate_sessions():
+    if db is None:
+        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+
+    # Unsetting token would collide on null in the old unique index, and
+    # new sessions have no token field at all, so drop it first
+    try:
+        await db["session"].drop_index("token_1")
+    except OperationFailure:
+        pass  # already dropped
+
+    ops = []
+    async for sess in db["session"].find({"token_hash": {"$exists": False}, "token": {"$exists": True}}):
+        expires_at = sess.get("expires_at")
+        if isinstance(expires_at, (int, float)):
+            expires_at = datetime.fromtimestamp(expires_at, tz=timezone.utc)
+        ops.append(UpdateOne(
+            {"_id": sess["_id"]},
+            {"$set": {"token_hash": _hash_token(sess["token"]), "expires_at": expires_at}, "$unset": {"token": ""}},
+        ))
+    if ops:
+        await db["session"].bulk_write(ops, ordered=False)
+
+    return len(ops)
+
+
+if __name__ == "__main__":
+    migrated = asyncio.run(migrate_sessions())
+    print(f"Migrated {migrated} session(s)")
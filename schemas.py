@@ -13,6 +13,7 @@ Model name is converted to lowercase for the collection name:
 
 from pydantic import BaseModel, Field, HttpUrl
 from typing import Optional, List, Dict
+from datetime import datetime
 
 class Developer(BaseModel):
     """
@@ -36,9 +37,9 @@ class Session(BaseModel):
     Session tokens for authenticated users
     Collection: "session"
     """
-    token: str = Field(..., description="Opaque session token")
+    token_hash: bytes = Field(..., description="blake2b-128 digest of the opaque session token")
     user_id: str = Field(..., description="Reference to developer _id")
-    expires_at: float = Field(..., description="Unix timestamp when token expires")
+    expires_at: datetime = Field(..., description="UTC datetime when token expires (TTL indexed)")
 
 class Portfolio(BaseModel):
     """
@@ -0,0 +1,66 @@
+import base64
+import struct
+import time
+
+import pytest
+
+import main
+
+
+@pytest.fixture(autouse=True)
+def oauth_config(monkeypatch):
+    monkeypatch.setattr(main, "OAUTH_STATE_SECRET", "test-secret")
+    monkeypatch.setattr(main, "GITHUB_CLIENTS", [("id-a", "secret-a"), ("id-b", "secret-b")])
+
+
+def _forge(payload: bytes) -> str:
+    return base64.urlsafe_b64encode(payload + main._state_mac(payload)).rstrip(b"=").decode()
+
+
+def test_round_trip_returns_client_index():
+    assert main._verify_state(main._sign_state(0)) == 0
+    assert main._verify_state(main._sign_state(1)) == 1
+
+
+def test_tampered_mac_is_rejected():
+    raw = bytearray(base64.urlsafe_b64decode(main._sign_state(0) + "="))
+    raw[-1] ^= 0x01
+    assert main._verify_state(base64.urlsafe_b64encode(bytes(raw)).rstrip(b"=").decode()) is None
+
+
+def test_wrong_length_is_rejected():
+    payload = b"\x00" * 16 + struct.pack(">Q", int(time.time()))  # no client index
+    assert main._verify_state(_forge(payload)) is None
+    assert main._verify_state(main._sign_state(0)[:-4]) is None
+
+
+def test_expired_state_is_rejected():
+    issued_at = int(time.time()) - main.OAUTH_STATE_TTL - 1
+    assert main._verify_state(_forge(b"\x00" * 16 + struct.pack(">QB", issued_at, 0))) is None
+
+
+def test_missing_state_is_rejected():
+    assert main._verify_state(None) is None
+
+
+def test_out_of_range_client_index_is_rejected():
+    assert main._verify_state(_forge(b"\x00" * 16 + struct.pack(">QB", int(time.time()), 2))) is None
+
+
+def test_other_secret_is_rejected(monkeypatch):
+    state = main._sign_state(0)
+    monkeypatch.setattr(main, "OAUTH_STATE_SECRET", "rotated")
+    assert main._verify_state(state) is None
+
+
+def test_endpoints_require_state_secret(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    monkeypatch.setattr(main, "OAUTH_STATE_SECRET", None)
+    main.app.dependency_overrides[main.get_db] = lambda: {}
+    try:
+        client = TestClient(main.app)
+        assert client.get("/auth/github/start").status_code == 500
+        assert client.get("/auth/github/callback", params={"code": "x"}).status_code == 500
+    finally:
+        main.app.dependency_overrides.clear()